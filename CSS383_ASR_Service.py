@@ -0,0 +1,522 @@
+#------------------------CSS383_ASR_Service.py---------------------------------
+# Created: 10-19-2026
+# Modified: 10-19-2026
+#-------------------------------------------------------------------------------
+# Purpose: A local HTTP/JSON service around the ASRTree in
+#          CSS383_Project_2_ASR.py. Trees and look-up files are parsed and
+#          reconstructed once per worker process and kept resident, so
+#          requests only pay for compute rather than for importing ETE3 and
+#          re-reading the input files every time.
+#
+# Endpoints:
+#   POST /reconstruct {"tree": path, "lookup": path}
+#   POST /simulate    {"tree": path, "lookup": path, "num_sims": n,
+#                      "stream": bool, "job_id": name,
+#                      "checkpoint_interval": n}
+#   GET  /status
+#
+# Simulations given a job_id checkpoint to that job's file in the service's
+# checkpoint directory, and a later request with the same job_id resumes it.
+# Streaming simulations answer with newline-delimited JSON progress events
+# read from the run's checkpoint file, followed by a final result event.
+# When the job queue is full, new jobs are rejected with 503 so callers can
+# back off instead of piling up behind a long simulation.
+#-------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from CSS383_Project_2_ASR import ASRTree
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8383
+DEFAULT_QUEUE_SIZE = 64 #Number of jobs that may wait for a worker before new jobs are rejected
+DEFAULT_CHECKPOINT_DIR = os.path.join(tempfile.gettempdir(), "asr_service_checkpoints")
+DEFAULT_MAX_SIMS = 10**8 #Largest simulation accepted; a worker holds 8 bytes of effect size per simulation
+PARENT_CHECK_INTERVAL = 1.0 #Seconds between a worker's checks that the service is still running
+PROGRESS_INTERVAL = 1.0 #Seconds between progress events of a streamed simulation
+MAX_BODY_SIZE = 64*1024 #Largest request body accepted, in bytes
+JOB_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}") #Job ids name files, so they are kept to safe characters
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 409: "Conflict",\
+413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+_asr_cache = dict() #Worker-side cache of reconstructed ASRTrees keyed by input file paths
+
+#Worker Functions
+
+#------------------------------_load_asr----------------------------------------
+# Description: Returns the reconstructed ASRTree for the tree and look-up
+#              files, building it only if this worker has not seen the files
+#              yet or they have been modified since.
+#-------------------------------------------------------------------------------
+def _load_asr(tree_path, lookup_path):
+    key = (os.path.abspath(tree_path), os.path.abspath(lookup_path))
+    mtimes = (os.path.getmtime(tree_path), os.path.getmtime(lookup_path))
+    cached = _asr_cache.get(key)
+    if cached is None or cached[0] != mtimes:
+        asr = ASRTree()
+        asr.build_tree(tree_path)
+        asr.import_lookup(lookup_path)
+        asr.run_max_parsimony()
+        cached = _asr_cache[key] = (mtimes, asr)
+    return cached[1]
+#end _load_asr
+
+#----------------------------_watch_parent--------------------------------------
+# Description: Ends the worker process once the service process that started
+#              it has gone, so an orphaned worker never keeps writing to a
+#              checkpoint file a restarted service wants to resume.
+#-------------------------------------------------------------------------------
+def _watch_parent(parent_pid):
+    while os.getppid() == parent_pid:
+        time.sleep(PARENT_CHECK_INTERVAL)
+    os._exit(1)
+#end _watch_parent
+
+#-----------------------------_warm_worker--------------------------------------
+# Description: Process pool initializer that starts the parent watchdog and
+#              reconstructs the preloaded datasets as soon as a worker starts.
+#-------------------------------------------------------------------------------
+def _warm_worker(preload, parent_pid):
+    threading.Thread(target=_watch_parent, args=(parent_pid,), daemon=True).start()
+    for tree_path, lookup_path in preload:
+        _load_asr(tree_path, lookup_path)
+#end _warm_worker
+
+#-------------------------------_ping-------------------------------------------
+# Description: No-op job used to start the worker processes ahead of time.
+#-------------------------------------------------------------------------------
+def _ping():
+    return os.getpid()
+#end _ping
+
+#-----------------------------_reconstruct--------------------------------------
+# Description: Worker job returning the result of the maximum parsimony
+#              reconstruction.
+#-------------------------------------------------------------------------------
+def _reconstruct(tree_path, lookup_path):
+    asr = _load_asr(tree_path, lookup_path)
+    return {"num_taxa": asr.get_num_taxa(), "effect_size": asr.get_effect_size(),\
+    "summary": asr.to_string()}
+#end _reconstruct
+
+#------------------------------_simulate----------------------------------------
+# Description: Worker job running the Monte Carlo simulations, checkpointing
+#              to checkpoint_path if one is given. The effect sizes are
+#              freed afterwards so the cached ASRTree does not keep them.
+#-------------------------------------------------------------------------------
+def _simulate(tree_path, lookup_path, num_sims, checkpoint_path, checkpoint_interval):
+    asr = _load_asr(tree_path, lookup_path)
+    try:
+        asr.monte_carlo_sim(num_sims, checkpoint_path, checkpoint_interval)
+        return {"num_sims": num_sims, "effect_size": asr.get_effect_size(), "p_value": asr.get_p_value()}
+    finally:
+        asr.clear_sim_effect_sizes()
+#end _simulate
+
+class ASRService:
+    #Attributes
+    __pool = None #Warm worker processes
+    __preload = None #(tree path, look-up path) pairs reconstructed by every new worker
+    __queue = None #Jobs waiting for a worker
+    __jobs = None #Futures of queued and running jobs
+    __pending = None #Queued or running reconstructions, shared by identical requests
+    __active_jobs = None #Job ids of simulations whose checkpoint file is in use
+    __checkpoint_dir = None #Directory holding the checkpoint files of simulation jobs
+    __address = None #(host, port) the service is listening on
+    __num_workers = 0
+    __queue_size = 0
+    __max_sims = 0
+    __worker_restarts = 0
+
+#Public Methods
+
+    #--------------------------constructor--------------------------------------
+    # Description: Creates the process pool; preload is a list of
+    #              (tree path, look-up path) pairs every worker reconstructs
+    #              on start-up.
+    #---------------------------------------------------------------------------
+    def __init__(self, num_workers=None, queue_size=DEFAULT_QUEUE_SIZE, preload=(),\
+    checkpoint_dir=DEFAULT_CHECKPOINT_DIR, max_sims=DEFAULT_MAX_SIMS):
+        self.__num_workers = num_workers or os.cpu_count() or 1
+        self.__queue_size = queue_size
+        self.__max_sims = max_sims
+        self.__pending = dict()
+        self.__active_jobs = set()
+        self.__jobs = set()
+        self.__checkpoint_dir = checkpoint_dir
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.__preload = list(preload)
+        self.__pool = self.__new_pool()
+    #end constructor
+
+    #-------------------------------serve---------------------------------------
+    # Description: Starts the workers and job dispatchers, then serves HTTP
+    #              requests until cancelled or sent SIGINT/SIGTERM. On the
+    #              way out, outstanding jobs are cancelled and the worker
+    #              processes are terminated.
+    #---------------------------------------------------------------------------
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        loop = asyncio.get_running_loop()
+        self.__queue = asyncio.Queue(maxsize=self.__queue_size)
+        dispatchers = []
+        signals = []
+        try:
+            await self.__warm_pool(self.__pool)
+            dispatchers = [asyncio.ensure_future(self.__dispatch()) for _ in range(self.__num_workers)]
+            server = await asyncio.start_server(self.__handle, host, port)
+            self.__address = server.sockets[0].getsockname()[:2]
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(signal_number, asyncio.current_task().cancel)
+                    signals.append(signal_number)
+                except (NotImplementedError, RuntimeError): #Windows, or not the main thread
+                    pass
+            print("\nASR service listening on http://%s:%d with %d workers" % (self.__address[0],\
+            self.__address[1], self.__num_workers))
+            async with server:
+                await server.serve_forever()
+        finally:
+            for signal_number in signals:
+                loop.remove_signal_handler(signal_number)
+            for dispatcher in dispatchers:
+                dispatcher.cancel()
+            for future in list(self.__jobs):
+                future.cancel()
+            self.__terminate_pool(self.__pool)
+            self.__address = None
+    #end serve
+
+    #----------------------------get_address------------------------------------
+    # Description: Returns the (host, port) the service is listening on, or
+    #              None if it is not serving.
+    #---------------------------------------------------------------------------
+    def get_address(self):
+        return self.__address
+    #end get_address
+
+    #----------------------------reconstruct------------------------------------
+    # Description: Queues a reconstruction job. Requests for the same files
+    #              made while one is queued or running share its result.
+    #              Simulations are not shared this way: each one is a fresh
+    #              random sample with its own checkpoint file and progress.
+    #---------------------------------------------------------------------------
+    def reconstruct(self, tree_path, lookup_path):
+        key = (os.path.abspath(tree_path), os.path.abspath(lookup_path))
+        future = self.__pending.get(key)
+        if future is None:
+            future = self.__submit(_reconstruct, key)
+            self.__pending[key] = future
+            future.add_done_callback(lambda done: self.__pending.pop(key, None))
+        return future
+    #end reconstruct
+
+    #-----------------------------simulate--------------------------------------
+    # Description: Queues a Monte Carlo simulation job.
+    #---------------------------------------------------------------------------
+    def simulate(self, tree_path, lookup_path, num_sims, checkpoint_path=None,\
+    checkpoint_interval=ASRTree.CHECKPOINT_INTERVAL):
+        return self.__submit(_simulate, (tree_path, lookup_path, num_sims, checkpoint_path, checkpoint_interval))
+    #end simulate
+
+    #-----------------------------get_status------------------------------------
+    # Description: Returns the load of the service.
+    #---------------------------------------------------------------------------
+    def get_status(self):
+        return {"workers": self.__num_workers, "queued": self.__queue.qsize(),\
+        "queue_size": self.__queue_size, "shared_reconstructions": len(self.__pending),\
+        "active_simulations": len(self.__active_jobs), "worker_restarts": self.__worker_restarts}
+    #end get_status
+
+#Private Methods
+    #------------------------------__new_pool-----------------------------------
+    # Description: Creates a process pool whose workers preload the datasets
+    #              and exit if the service process goes away.
+    #---------------------------------------------------------------------------
+    def __new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.__num_workers, initializer=_warm_worker,\
+        initargs=(self.__preload, os.getpid()))
+    #end __new_pool
+
+    #------------------------------__warm_pool----------------------------------
+    # Description: Starts every worker of the pool ahead of the first job.
+    #---------------------------------------------------------------------------
+    async def __warm_pool(self, pool):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(pool, _ping) for _ in range(self.__num_workers)])
+    #end __warm_pool
+
+    #----------------------------__replace_pool---------------------------------
+    # Description: Swaps a pool broken by a dead worker for a new warm one.
+    #---------------------------------------------------------------------------
+    def __replace_pool(self):
+        self.__terminate_pool(self.__pool)
+        self.__pool = self.__new_pool()
+        self.__worker_restarts += 1
+        print("\nA worker process died. Started a new worker pool.")
+        warming = asyncio.ensure_future(self.__warm_pool(self.__pool))
+        warming.add_done_callback(lambda done: done.cancelled() or done.exception()) #Failures surface on the next job
+    #end __replace_pool
+
+    #----------------------------__terminate_pool-------------------------------
+    # Description: Shuts a pool down without waiting for running jobs, killing
+    #              its worker processes. ProcessPoolExecutor only gained
+    #              terminate_workers() in Python 3.14, so older versions fall
+    #              back to its process table.
+    #---------------------------------------------------------------------------
+    def __terminate_pool(self, pool):
+        if hasattr(pool, "terminate_workers"):
+            pool.terminate_workers()
+            return
+        for process in list((getattr(pool, "_processes", None) or dict()).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+    #end __terminate_pool
+
+    #------------------------------__submit-------------------------------------
+    # Description: Puts a job on the queue and returns a future for its
+    #              result. Raises asyncio.QueueFull when the service is
+    #              saturated.
+    #---------------------------------------------------------------------------
+    def __submit(self, func, args):
+        future = asyncio.get_running_loop().create_future()
+        self.__queue.put_nowait((func, args, future))
+        self.__jobs.add(future)
+        future.add_done_callback(self.__jobs.discard)
+        return future
+    #end __submit
+
+    #-----------------------------__dispatch------------------------------------
+    # Description: Takes jobs off the queue and runs them on the process pool,
+    #              one at a time per worker. If a worker dies, the jobs it
+    #              took down fail and the pool is replaced.
+    #---------------------------------------------------------------------------
+    async def __dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            func, args, future = await self.__queue.get()
+            pool = self.__pool
+            try:
+                result = await loop.run_in_executor(pool, func, *args)
+                if not future.done():
+                    future.set_result(result)
+            except BrokenProcessPool:
+                if not future.done():
+                    future.set_exception(BrokenProcessPool("A worker process died while running this job."))
+                if pool is self.__pool: #Only the first dispatcher to notice replaces it
+                    self.__replace_pool()
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+            finally:
+                self.__queue.task_done()
+    #end __dispatch
+
+    #------------------------------__handle-------------------------------------
+    # Description: Reads one HTTP request, routes it and writes the response.
+    #---------------------------------------------------------------------------
+    async def __handle(self, reader, writer):
+        try:
+            method, path, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+            headers = dict()
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            content_length = int(headers.get("content-length", 0))
+            if content_length > MAX_BODY_SIZE:
+                await self.__respond(writer, 413, {"error": "Request body is larger than %d bytes." % MAX_BODY_SIZE})
+                return
+            body = await reader.readexactly(content_length)
+            request = json.loads(body) if body else dict()
+            await self.__route(method, path, request, writer)
+        except asyncio.QueueFull:
+            await self.__respond(writer, 503, {"error": "Job queue is full. Please try again later."},\
+            [("Retry-After", "1")])
+        except (ValueError, KeyError, TypeError) as error:
+            await self.__respond(writer, 400, {"error": "Invalid request: %s" % error})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as error:
+            await self.__respond(writer, 500, {"error": str(error)})
+        finally:
+            writer.close()
+    #end __handle
+
+    #------------------------------__route--------------------------------------
+    # Description: Dispatches a parsed request to its endpoint.
+    #---------------------------------------------------------------------------
+    async def __route(self, method, path, request, writer):
+        if method == "GET" and path == "/status":
+            await self.__respond(writer, 200, self.get_status())
+        elif method == "POST" and path == "/reconstruct":
+            future = self.reconstruct(str(request["tree"]), str(request["lookup"]))
+            await self.__respond(writer, *(await self.__await_job(future)))
+        elif method == "POST" and path == "/simulate":
+            num_sims = int(request["num_sims"])
+            if num_sims <= 0 or num_sims > self.__max_sims:
+                raise ValueError("num_sims must be between 1 and %d" % self.__max_sims)
+            checkpoint_interval = int(request.get("checkpoint_interval",\
+            max(1, min(ASRTree.CHECKPOINT_INTERVAL, num_sims//100))))
+            if checkpoint_interval <= 0:
+                raise ValueError("checkpoint_interval must be positive")
+            stream = bool(request.get("stream", False))
+            job_id = request.get("job_id")
+            temporary = job_id is None and stream #Progress is read from the checkpoint file, so streams always need one
+            if temporary:
+                job_id = uuid.uuid4().hex
+            checkpoint_path = None
+            if job_id is not None:
+                job_id = str(job_id)
+                if not JOB_ID_PATTERN.fullmatch(job_id):
+                    raise ValueError("job_id must be 1 to 64 letters, digits, '-' or '_'")
+                if job_id in self.__active_jobs:
+                    await self.__respond(writer, 409, {"error": "Job %s is already running." % job_id})
+                    return
+                checkpoint_path = os.path.join(self.__checkpoint_dir, job_id + ".asrc")
+                self.__active_jobs.add(job_id)
+            future = None
+            try:
+                future = self.simulate(str(request["tree"]), str(request["lookup"]), num_sims,\
+                checkpoint_path, checkpoint_interval)
+                if stream:
+                    await self.__stream_simulation(writer, future, checkpoint_path, num_sims,\
+                    None if temporary else job_id)
+                else:
+                    status, payload = await self.__await_job(future)
+                    if status == 200 and job_id is not None:
+                        payload = dict(payload, job_id=job_id)
+                    await self.__respond(writer, status, payload)
+            finally:
+                if job_id is not None:
+                    if future is not None: #Keep the file reserved until the worker has finished writing it
+                        await asyncio.wait({future})
+                    self.__active_jobs.discard(job_id)
+                    if temporary and os.path.exists(checkpoint_path):
+                        os.remove(checkpoint_path)
+        else:
+            await self.__respond(writer, 404, {"error": "Unknown endpoint %s %s" % (method, path)})
+    #end __route
+
+    #----------------------------__await_job------------------------------------
+    # Description: Waits for a job and returns the status and body to answer
+    #              with. The future is shielded so a dropped client does not
+    #              cancel a result other requests are sharing. Missing input
+    #              files and rejected checkpoints are the client's error,
+    #              and a job lost with a dead worker or cancelled at shutdown
+    #              can be retried.
+    #---------------------------------------------------------------------------
+    async def __await_job(self, future):
+        try:
+            return 200, await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled(): #The request itself was cancelled
+                raise
+            return 503, {"error": "The service is shutting down. Please try again later."}
+        except BrokenProcessPool as error:
+            return 503, {"error": "%s Please try again." % error}
+        except FileNotFoundError as error:
+            return 404, {"error": "Input file not found: %s" % error.filename}
+        except ValueError as error:
+            return 400, {"error": str(error)}
+        except Exception as error:
+            return 500, {"error": str(error)}
+    #end __await_job
+
+    #-------------------------__stream_simulation-------------------------------
+    # Description: Streams newline-delimited JSON progress events for a
+    #              simulation from its checkpoint file, then the result. The
+    #              file is read off the event loop, continuing from the end
+    #              of the last record already reported. Once the 200 header
+    #              is sent, errors are reported as the final event. The job
+    #              id is only included if the caller named the job.
+    #---------------------------------------------------------------------------
+    async def __stream_simulation(self, writer, future, checkpoint_path, num_sims, job_id):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"\
+        b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        loop = asyncio.get_running_loop()
+        offset = 0
+        try:
+            while not future.done():
+                await asyncio.wait({future}, timeout=PROGRESS_INTERVAL)
+                checkpoint = await loop.run_in_executor(None, ASRTree.read_checkpoint, checkpoint_path,\
+                False, offset)
+                if checkpoint is not None and not future.done():
+                    offset = checkpoint["end_offset"]
+                    await self.__write_chunk(writer, {"completed": checkpoint["completed"],\
+                    "num_sims": num_sims, "p_value": checkpoint["p_value"]})
+            status, payload = await self.__await_job(future)
+            event = dict(payload, done=True)
+            if status == 200 and job_id is not None:
+                event["job_id"] = job_id
+        except ConnectionError:
+            raise
+        except Exception as error:
+            event = {"error": str(error), "done": True}
+        await self.__write_chunk(writer, event)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+    #end __stream_simulation
+
+    #----------------------------__write_chunk----------------------------------
+    # Description: Writes one JSON event as an HTTP chunk.
+    #---------------------------------------------------------------------------
+    async def __write_chunk(self, writer, event):
+        data = (json.dumps(event) + "\n").encode("utf-8")
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        await writer.drain()
+    #end __write_chunk
+
+    #-----------------------------__respond-------------------------------------
+    # Description: Writes a complete JSON response.
+    #---------------------------------------------------------------------------
+    async def __respond(self, writer, status, payload, extra_headers=()):
+        data = json.dumps(payload).encode("utf-8")
+        head = "HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n"\
+        % (status, STATUS_TEXT[status], len(data))
+        for name, value in extra_headers:
+            head += "%s: %s\r\n" % (name, value)
+        writer.write((head + "Connection: close\r\n\r\n").encode("latin-1") + data)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+    #end __respond
+
+#end ASRService
+
+ #--------------------------------main------------------------------------------
+ # Description: Starts the service from the command line.
+ #------------------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP/JSON service for ancestral state reconstructions.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,\
+    help="jobs allowed to wait for a worker before requests are rejected with 503")
+    parser.add_argument("--checkpoint-dir", default=DEFAULT_CHECKPOINT_DIR,\
+    help="directory holding the checkpoint files of simulation jobs")
+    parser.add_argument("--max-sims", type=int, default=DEFAULT_MAX_SIMS,\
+    help="largest num_sims a simulation request may ask for")
+    parser.add_argument("--preload", nargs=2, action="append", default=[], metavar=("TREE", "LOOKUP"),\
+    help="tree and look-up file every worker reconstructs on start-up (repeatable)")
+    args = parser.parse_args()
+    service = ASRService(args.workers, args.queue_size, [tuple(pair) for pair in args.preload],\
+    args.checkpoint_dir, args.max_sims)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("\n\nASR service stopped\n\n")
@@ -15,6 +15,15 @@ from ete3 import Tree
 from ete3 import EvolTree
 import xlrd
 import random
+import os
+import sys
+import mmap
+import struct
+from array import array
+try:
+    import fcntl
+except ImportError: #Windows has no fcntl, so checkpoint files are not locked there
+    fcntl = None
 import matplotlib.pyplot as plt
 import seaborn as sns
 
@@ -24,7 +33,7 @@ class ASRTree:
     __sim_tree = None #Simulation tree
     ____transition_prob_anad = None
     __transition_prob_aqp3 = None
-    __sim_effect_sizes = [] #List containing simulation effect sizes
+    __sim_effect_sizes = None #Array containing simulation effect sizes
     __p_value_count = 0 #Number of times an effect size is simulated => actual
     __effect_size = 0 #Actual effect size of model
     __num_of_branches = __num_anad = __num_aqp3 = __num_anad_and_aqp3 = __num_taxa = __p_value = 0
@@ -34,16 +43,23 @@ class ASRTree:
     ANAD_INDEX = 2
     AQP3_INDEX = 3
     EPSILON = 0.00000000000000000001 #Number being added to anadromy/aqp3 variables to avoid division by 0 in effect size
+    CHECKPOINT_MAGIC = b"ASRC" #Tag at the start of every checkpoint record
+    CHECKPOINT_HEADER = struct.Struct("<4sQQQdQ") #Magic, sims completed, p-value count, sims requested, actual effect size, effect sizes in record
+    CHECKPOINT_RNG_STATE = struct.Struct("<I625I?d") #random.getstate(): version, Mersenne Twister state, whether a Gaussian is cached and its value
+    CHECKPOINT_INTERVAL = 10000 #Default number of simulations between checkpoints
 
 #Public Methods
 
     #--------------------------constructor--------------------------------------
     # Description: Constructs ASTree and sets default value for tree, and creates
     #              the 2D list for transition rate matrix, setting initial
-    #              values to 0.
+    #              values to 0. The look-up and effect size containers are
+    #              created per instance so several trees can be held at once.
     #---------------------------------------------------------------------------
     def __init__(self):
         self.__tree = None
+        self.__sim_effect_sizes = array("d")
+        self.__anadromy_lookup = dict()
         self.____transition_prob_anad = [[0.0 for x in range(2)] for y in range(2)]
         self.__transition_prob_aqp3 = [[0.0 for x in range(2)] for y in range(2)]
     #end constructor
@@ -93,6 +109,13 @@ class ASRTree:
         return self.__p_value
     #end get_p_value
 
+    #---------------------------get_effect_size---------------------------------
+    # Description: Returns the actual effect size of the model.
+    #---------------------------------------------------------------------------
+    def get_effect_size(self):
+        return self.__effect_size
+    #end get_effect_size
+
     #--------------------------import_lookup------------------------------------
     # Description: Imports the look-up file for assigning character state
     #              changes and taxa names.
@@ -122,7 +145,7 @@ class ASRTree:
                     self.__anadromy_lookup[values[0]] = values[1:]
                     values.clear()
 
-        __num_taxa = len(self.__anadromy_lookup)
+        self.__num_taxa = len(self.__anadromy_lookup)
     #end import_lookup
 
     #----------------------------show_tree--------------------------------------
@@ -167,62 +190,178 @@ class ASRTree:
     #              in order to test the hypothesis. Each simulation checks
     #              the ancestral node in the tree, then refers to the transition
     #              rate matrix for the probability of getting the same or a
-    #              different character state.
+    #              different character state. If a checkpoint path is given,
+    #              progress is appended to that file every checkpoint_interval
+    #              simulations, and a run already recorded there is resumed
+    #              from its last checkpoint. The file is locked for the whole
+    #              run. Raises ValueError if the file is not a checkpoint
+    #              file, belongs to a different run or is in use by another
+    #              run.
     #---------------------------------------------------------------------------
-    def monte_carlo_sim(self, num_sims):
+    def monte_carlo_sim(self, num_sims, checkpoint_path=None, checkpoint_interval=CHECKPOINT_INTERVAL):
+        if checkpoint_path is not None and checkpoint_interval <= 0:
+            raise ValueError("The checkpoint interval must be a positive number of simulations.")
         #Checks if there already is a simulation tree to avoid unncessary copies
         self.__p_value_count = 0 #Initialize back to 0
-        self.__sim_effect_sizes.clear() #Initialize back to empty
+        self.__sim_effect_sizes = array("d") #Initialize back to empty
         if self.__sim_tree is None:
             self.__sim_tree = self.__tree.copy()
-        for sim in range(num_sims):
-            #Set values of each count back to the EPSILON value to avoid
-            #division by 0 in the effect size
-            aqp3_count = self.EPSILON
-            anad_count = self.EPSILON
-            anad_aqp3_count = self.EPSILON
-            for node in self.__sim_tree.traverse("preorder"):
-                rand_num_1 = random.randint(0, 1001)
-                rand_num_2 = random.randint(0, 1001)
-                if not node.is_root():
-                    #Check each ancestor's character state, and roll a random
-                    #number against the probability of going from that state to
-                    #the same or a different state based on transition matrix
-                    #and assign that character state. Tally all gains
-                    if node.up.anadromy == 1:
-                        if (self.____transition_prob_anad[1][0]*1000) > rand_num_1:
-                            node.add_feature("anadromy", 0)
-                        else:
-                            node.add_feature("anadromy", 1)
-                            anad_count += 1
-                    else:
-                        if (self.____transition_prob_anad[0][1]*1000) < rand_num_1:
-                            node.add_feature("anadromy", 0)
+        start_sim = 0
+        last_checkpoint = 0
+        checkpoint_file = None
+        if checkpoint_path is not None:
+            checkpoint_file = self.__open_checkpoint(checkpoint_path)
+        try:
+            if checkpoint_file is not None:
+                checkpoint = ASRTree.read_checkpoint(checkpoint_path)
+                end_offset = 0
+                if checkpoint is not None:
+                    if checkpoint["num_sims"] != num_sims or checkpoint["effect_size"] != self.__effect_size:
+                        raise ValueError("Checkpoint file " + checkpoint_path + " belongs to a run of "\
+                        + str(checkpoint["num_sims"]) + " simulations with effect size "\
+                        + str(checkpoint["effect_size"]) + ", not to this run.")
+                    #Resume from the last checkpoint: restore the tally, the effect
+                    #sizes and the random number generator so the remaining
+                    #simulations match an uninterrupted run
+                    start_sim = last_checkpoint = checkpoint["completed"]
+                    self.__p_value_count = checkpoint["p_value_count"]
+                    self.__sim_effect_sizes = checkpoint["effect_sizes"]
+                    random.setstate(checkpoint["rng_state"])
+                    end_offset = checkpoint["end_offset"]
+                    print("\nResuming Monte Carlo simulations from simulation", start_sim)
+                #Cut off any record left half written by an interrupted run so new
+                #records follow straight after the last complete one
+                checkpoint_file.truncate(end_offset)
+            for sim in range(start_sim, num_sims):
+                #Set values of each count back to the EPSILON value to avoid
+                #division by 0 in the effect size
+                aqp3_count = self.EPSILON
+                anad_count = self.EPSILON
+                anad_aqp3_count = self.EPSILON
+                for node in self.__sim_tree.traverse("preorder"):
+                    rand_num_1 = random.randint(0, 1001)
+                    rand_num_2 = random.randint(0, 1001)
+                    if not node.is_root():
+                        #Check each ancestor's character state, and roll a random
+                        #number against the probability of going from that state to
+                        #the same or a different state based on transition matrix
+                        #and assign that character state. Tally all gains
+                        if node.up.anadromy == 1:
+                            if (self.____transition_prob_anad[1][0]*1000) > rand_num_1:
+                                node.add_feature("anadromy", 0)
+                            else:
+                                node.add_feature("anadromy", 1)
+                                anad_count += 1
                         else:
-                            node.add_feature("anadromy", 1)
-                            anad_count += 1
-                    if node.up.aqp3 == 1:
-                        if (self.__transition_prob_aqp3[1][0]*1000) > rand_num_2:
-                            node.add_feature("aqp3", 0)
+                            if (self.____transition_prob_anad[0][1]*1000) < rand_num_1:
+                                node.add_feature("anadromy", 0)
+                            else:
+                                node.add_feature("anadromy", 1)
+                                anad_count += 1
+                        if node.up.aqp3 == 1:
+                            if (self.__transition_prob_aqp3[1][0]*1000) > rand_num_2:
+                                node.add_feature("aqp3", 0)
+                            else:
+                                node.add_feature("aqp3", 1)
+                                aqp3_count += 1
                         else:
-                            node.add_feature("aqp3", 1)
-                            aqp3_count += 1
-                    else:
-                        if (self.__transition_prob_aqp3[0][1]*1000) < rand_num_2:
-                            node.add_feature("aqp3", 0)
-                        else:
-                            node.add_feature("aqp3", 1)
-                            aqp3_count += 1
-                    if node.anadromy == 1 and node.aqp3 == 1:
-                        anad_aqp3_count += 1
-            #Calculate the effect size and store the results.
-            eff_size = self.calc_effect_size(anad_count, aqp3_count, anad_aqp3_count)
-            self.__sim_effect_sizes.append(eff_size)
-            if eff_size >= self.__effect_size:
-                self.__p_value_count += 1
+                            if (self.__transition_prob_aqp3[0][1]*1000) < rand_num_2:
+                                node.add_feature("aqp3", 0)
+                            else:
+                                node.add_feature("aqp3", 1)
+                                aqp3_count += 1
+                        if node.anadromy == 1 and node.aqp3 == 1:
+                            anad_aqp3_count += 1
+                #Calculate the effect size and store the results.
+                eff_size = self.calc_effect_size(anad_count, aqp3_count, anad_aqp3_count)
+                self.__sim_effect_sizes.append(eff_size)
+                if eff_size >= self.__effect_size:
+                    self.__p_value_count += 1
+                if checkpoint_file is not None and (sim + 1) % checkpoint_interval == 0:
+                    self.__write_checkpoint(checkpoint_file, last_checkpoint, sim + 1, num_sims)
+                    last_checkpoint = sim + 1
+            if checkpoint_file is not None and last_checkpoint < num_sims:
+                self.__write_checkpoint(checkpoint_file, last_checkpoint, num_sims, num_sims)
+        finally:
+            if checkpoint_file is not None:
+                checkpoint_file.close() #Releases the lock
         self.__p_value = (self.__p_value_count/num_sims) #Calculate and store p-value
     #end monte_carlo_sim
 
+    #-------------------------read_checkpoint-----------------------------------
+    # Description: Public static method that memory-maps a checkpoint file and
+    #              returns the state of its last complete checkpoint as a
+    #              dictionary, or None if there is no complete checkpoint.
+    #              Safe to call from another process while a run is still
+    #              writing, so it can be used for a live p-value estimate.
+    #              Set include_effect_sizes to False to skip unpacking the
+    #              effect sizes when only the progress is needed. Pollers can
+    #              pass the end_offset of the previous result as start_offset
+    #              to only read records written since, in which case None
+    #              means nothing new and only the newer effect sizes are
+    #              returned. Raises ValueError if the file is not a
+    #              checkpoint file or its records do not follow on from each
+    #              other, as when two runs have written to it.
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def read_checkpoint(path, include_effect_sizes=True, start_offset=0):
+        if not os.path.exists(path) or os.path.getsize(path) <= start_offset:
+            return None
+        header_size = ASRTree.CHECKPOINT_HEADER.size
+        state_size = ASRTree.CHECKPOINT_RNG_STATE.size
+        effect_sizes = array("d")
+        header = first = None
+        previous = 0
+        end_offset = start_offset
+        with open(path, "rb") as checkpoint_file:
+            with mmap.mmap(checkpoint_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                #Records hold running totals, so only their headers are read
+                #while walking the file and only the last RNG state is decoded
+                while end_offset < len(data):
+                    if data[end_offset:end_offset + 4] != ASRTree.CHECKPOINT_MAGIC[:len(data) - end_offset]:
+                        raise ValueError(path + " is not a checkpoint file or is corrupted.")
+                    if end_offset + header_size > len(data):
+                        break #Partially written header from an interrupted run
+                    record = ASRTree.CHECKPOINT_HEADER.unpack_from(data, end_offset)
+                    effects_start = end_offset + header_size
+                    record_end = effects_start + record[5]*8 + state_size
+                    if record_end > len(data):
+                        break #Partially written record from an interrupted run
+                    if first is None:
+                        first = record
+                        if start_offset > 0: #Earlier records were checked by a previous read
+                            previous = record[1] - record[5]
+                    if record[1] != previous + record[5] or record[1] > record[3]\
+                    or record[3] != first[3] or record[4] != first[4]:
+                        raise ValueError(path + " holds records from more than one run or is corrupted.")
+                    previous = record[1]
+                    if include_effect_sizes:
+                        effect_sizes.frombytes(data[effects_start:record_end - state_size])
+                    header = record
+                    end_offset = record_end
+                if header is None:
+                    return None
+                state = ASRTree.CHECKPOINT_RNG_STATE.unpack_from(data, end_offset - state_size)
+        if sys.byteorder == "big": #Effect sizes are stored little-endian like the headers
+            effect_sizes.byteswap()
+        magic, completed, p_value_count, num_sims, effect_size, num_effects = header
+        checkpoint = {"completed": completed, "p_value_count": p_value_count, "num_sims": num_sims,\
+        "effect_size": effect_size, "end_offset": end_offset,\
+        "rng_state": (state[0], state[1:626], state[627] if state[626] else None),\
+        "p_value": p_value_count/completed if completed else 0}
+        if include_effect_sizes:
+            checkpoint["effect_sizes"] = effect_sizes
+        return checkpoint
+    #end read_checkpoint
+
+    #-----------------------clear_sim_effect_sizes------------------------------
+    # Description: Frees the simulated effect sizes once they are no longer
+    #              needed. The p-value of the last run is kept.
+    #---------------------------------------------------------------------------
+    def clear_sim_effect_sizes(self):
+        self.__sim_effect_sizes = array("d")
+    #end clear_sim_effect_sizes
+
     #--------------------------plot_histogram-----------------------------------
     # Description: Public method to plot the histogram for testing the null
     #              hypothesis.
@@ -280,6 +419,46 @@ class ASRTree:
     #end findTransitionProb
 
 #Private Methods
+    #-------------------------__write_checkpoint--------------------------------
+    # Description: Private method that appends a checkpoint record holding the
+    #              simulation count, p-value tally, the effect sizes simulated
+    #              since the previous checkpoint and the random number
+    #              generator state. Records are only ever appended, and a
+    #              resumed run cuts off any half-written record first, so a
+    #              run killed mid-write loses at most the record being written.
+    #---------------------------------------------------------------------------
+    def __write_checkpoint(self, checkpoint_file, previous, completed, num_sims):
+        new_effects = self.__sim_effect_sizes[previous:completed]
+        if sys.byteorder == "big": #Effect sizes are stored little-endian like the headers
+            new_effects.byteswap()
+        version, internal_state, gauss_next = random.getstate()
+        record = self.CHECKPOINT_HEADER.pack(self.CHECKPOINT_MAGIC, completed, self.__p_value_count,\
+        num_sims, self.__effect_size, len(new_effects))
+        record += new_effects.tobytes()
+        record += self.CHECKPOINT_RNG_STATE.pack(version, *internal_state, gauss_next is not None,\
+        gauss_next or 0.0)
+        checkpoint_file.write(record)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    #end __write_checkpoint
+
+    #-------------------------__open_checkpoint---------------------------------
+    # Description: Private method that opens a checkpoint file for appending
+    #              and takes an exclusive lock on it, so no two runs write to
+    #              the same file, even from different processes. The lock is
+    #              released when the file is closed.
+    #---------------------------------------------------------------------------
+    def __open_checkpoint(self, path):
+        checkpoint_file = open(path, "ab")
+        if fcntl is not None:
+            try:
+                fcntl.flock(checkpoint_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                checkpoint_file.close()
+                raise ValueError("Checkpoint file " + path + " is in use by another simulation run.")
+        return checkpoint_file
+    #end __open_checkpoint
+
     #---------------------------__down_pass-------------------------------------
     # Description: Private method to perform down-pass to assign character state
     #              to tips and internal nodes.
@@ -380,36 +559,44 @@ class ASRTree:
  # Description: The main/driver file to support the ASRTree. Interacts with user
  #              to import files, create the ASR, and display the result.
  #------------------------------------------------------------------------------
-newASR = ASRTree()
-user_input = 69
-print("\n\nWelcome to Anadromy Determinator 1000")
-input("\nPress Enter/Return to begin")
-while user_input != -1:
-    print("\n\n\tMain Menu")
-    user_input = int(input("\nChoose one of the following options:\n[1] Build Tree\
-    \n[2] Import Look-Up File\n[3] Run Maximum Parsimony\n[4] Tree Information\
-    \n[5] Display Tree\n[6] Run Monte Carlo Simulations\n[7] Show Histogram\
-    \n[8] Get P-Value\n[0] Exit Program\n\n"))
-    if user_input == 1:
-        newASR.build_tree("RAxML_bestTree.result")
-    elif user_input == 2:
-        path = input("\nPlease input the file path for the look-up file, fish_anadromy.xlsx: ")
-        newASR.import_lookup(path)
-    elif user_input == 3:
-        newASR.run_max_parsimony()
-    elif user_input == 4:
-        print(newASR.to_string())
-    elif user_input == 5:
-        newASR.show_tree()
-    elif user_input == 6:
-        newASR.monte_carlo_sim(1000)
-    elif user_input == 7:
-        newASR.plot_histogram()
-    elif user_input == 8:
-        print("\nP-Value:", newASR.get_p_value())
-    elif user_input == 0:
-        break
-    else:
-        print("\nInvalid Entry. Please try again.")
-
-print("\n\nThank you for using Anadromy Determinator 1000\n\n")
+if __name__ == "__main__":
+    newASR = ASRTree()
+    user_input = 69
+    print("\n\nWelcome to Anadromy Determinator 1000")
+    input("\nPress Enter/Return to begin")
+    while user_input != -1:
+        print("\n\n\tMain Menu")
+        user_input = int(input("\nChoose one of the following options:\n[1] Build Tree\
+        \n[2] Import Look-Up File\n[3] Run Maximum Parsimony\n[4] Tree Information\
+        \n[5] Display Tree\n[6] Run Monte Carlo Simulations\n[7] Show Histogram\
+        \n[8] Get P-Value\n[9] Run Checkpointed Monte Carlo Simulations\n[0] Exit Program\n\n"))
+        if user_input == 1:
+            newASR.build_tree("RAxML_bestTree.result")
+        elif user_input == 2:
+            path = input("\nPlease input the file path for the look-up file, fish_anadromy.xlsx: ")
+            newASR.import_lookup(path)
+        elif user_input == 3:
+            newASR.run_max_parsimony()
+        elif user_input == 4:
+            print(newASR.to_string())
+        elif user_input == 5:
+            newASR.show_tree()
+        elif user_input == 6:
+            newASR.monte_carlo_sim(1000)
+        elif user_input == 7:
+            newASR.plot_histogram()
+        elif user_input == 8:
+            print("\nP-Value:", newASR.get_p_value())
+        elif user_input == 9:
+            num_sims = int(input("\nPlease input the number of Monte Carlo simulations to run: "))
+            path = input("\nPlease input the file path for the checkpoint file (an existing file will be resumed): ")
+            try:
+                newASR.monte_carlo_sim(num_sims, path)
+            except ValueError as error:
+                print("\n****************Error****************\n" + str(error))
+        elif user_input == 0:
+            break
+        else:
+            print("\nInvalid Entry. Please try again.")
+
+    print("\n\nThank you for using Anadromy Determinator 1000\n\n")
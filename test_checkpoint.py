@@ -0,0 +1,71 @@
+#------------------------test_checkpoint.py------------------------------------
+# Purpose: Checks that a checkpointed Monte Carlo run killed part way through
+#          a checkpoint resumes to the same results as an uninterrupted run.
+#-------------------------------------------------------------------------------
+
+import os
+import random
+import pytest
+
+for module in ("ete3", "xlrd", "matplotlib", "seaborn"):
+    pytest.importorskip(module)
+
+from CSS383_Project_2_ASR import ASRTree
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def build_asr():
+    asr = ASRTree()
+    asr.build_tree(os.path.join(HERE, "RAxML_bestTree.result"))
+    asr.import_lookup(os.path.join(HERE, "fish_file.xlsx"))
+    asr.run_max_parsimony()
+    return asr
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path):
+    path = str(tmp_path / "run.asrc")
+    random.seed(383)
+    full_run = build_asr()
+    full_run.monte_carlo_sim(1000, path, 100)
+    expected = ASRTree.read_checkpoint(path)
+
+    #Kill the run half way through writing its sixth checkpoint, then resume
+    record_size = os.path.getsize(path)//10
+    os.truncate(path, 5*record_size + record_size//2)
+    random.seed(0)
+    resumed_run = build_asr()
+    resumed_run.monte_carlo_sim(1000, path, 100)
+    resumed = ASRTree.read_checkpoint(path)
+
+    assert resumed_run.get_p_value() == full_run.get_p_value()
+    assert resumed["effect_sizes"] == expected["effect_sizes"]
+    assert os.path.getsize(path) == 10*record_size
+    with pytest.raises(ValueError):
+        resumed_run.monte_carlo_sim(500, path, 100)
+
+def test_non_checkpoint_file_is_left_untouched(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("not a checkpoint")
+    with pytest.raises(ValueError):
+        build_asr().monte_carlo_sim(10, str(path), 5)
+    assert path.read_text() == "not a checkpoint"
+
+def test_checkpoint_in_use_is_rejected(tmp_path):
+    fcntl = pytest.importorskip("fcntl")
+    path = str(tmp_path / "run.asrc")
+    build_asr().monte_carlo_sim(100, path, 50)
+    size = os.path.getsize(path)
+    with open(path, "ab") as other_run:
+        fcntl.flock(other_run.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        with pytest.raises(ValueError):
+            build_asr().monte_carlo_sim(100, path, 50)
+    assert os.path.getsize(path) == size
+
+def test_records_from_two_runs_are_rejected(tmp_path):
+    path = str(tmp_path / "run.asrc")
+    build_asr().monte_carlo_sim(100, path, 50)
+    with open(path, "rb") as checkpoint_file:
+        data = checkpoint_file.read()
+    with open(path, "ab") as checkpoint_file:
+        checkpoint_file.write(data[:len(data)//2]) #A second run's first record
+    with pytest.raises(ValueError):
+        ASRTree.read_checkpoint(path)
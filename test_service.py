@@ -0,0 +1,110 @@
+#------------------------test_service.py---------------------------------------
+# Purpose: Exercises the ASR service over HTTP with a single warm worker:
+#          status, shared reconstructions, backpressure, job id reservation,
+#          streamed progress and client errors.
+#-------------------------------------------------------------------------------
+
+import asyncio
+import json
+import os
+import pytest
+
+for module in ("ete3", "xlrd", "matplotlib", "seaborn"):
+    pytest.importorskip(module)
+
+import CSS383_ASR_Service
+from CSS383_ASR_Service import ASRService
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TREE = os.path.join(HERE, "RAxML_bestTree.result")
+LOOKUP = os.path.join(HERE, "fish_file.xlsx")
+LONG_RUN = {"tree": TREE, "lookup": LOOKUP, "num_sims": 10**6} #Keeps the only worker busy until shutdown
+
+async def request(address, method, path, body=None, content_length=None):
+    reader, writer = await asyncio.open_connection(*address)
+    data = json.dumps(body).encode() if body is not None else b""
+    head = "%s %s HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (method, path,\
+    len(data) if content_length is None else content_length)
+    writer.write(head.encode() + (data if content_length is None else b""))
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.decode().partition("\r\n\r\n")
+    return int(head.split()[1]), head, body
+
+def events(body): #Newline-delimited JSON events of a chunked streaming body
+    return [json.loads(line) for line in body.splitlines() if line.startswith("{")]
+
+def run_service(tmp_path, check, queue_size=4):
+    async def main():
+        service = ASRService(1, queue_size, [(TREE, LOOKUP)], str(tmp_path), max_sims=10**6)
+        serving = asyncio.ensure_future(service.serve("127.0.0.1", 0))
+        while service.get_address() is None:
+            if serving.done():
+                serving.result()
+            await asyncio.sleep(0.05)
+        try:
+            await check(service.get_address())
+        finally:
+            serving.cancel()
+            await asyncio.gather(serving, return_exceptions=True)
+    asyncio.run(main())
+
+def test_status(tmp_path):
+    async def check(address):
+        status, _, body = await request(address, "GET", "/status")
+        assert status == 200
+        assert json.loads(body)["workers"] == 1 and json.loads(body)["queued"] == 0
+    run_service(tmp_path, check)
+
+def test_identical_reconstructions_share_one_result(tmp_path):
+    async def check(address):
+        blocker = asyncio.ensure_future(request(address, "POST", "/simulate", dict(LONG_RUN, num_sims=20000)))
+        await asyncio.sleep(0.5)
+        same = [asyncio.ensure_future(request(address, "POST", "/reconstruct", {"tree": path, "lookup": LOOKUP}))\
+        for path in (TREE, os.path.relpath(TREE))]
+        await asyncio.sleep(0.5)
+        status = json.loads((await request(address, "GET", "/status"))[2])
+        assert status["queued"] == 1 and status["shared_reconstructions"] == 1
+        first, second = await asyncio.gather(*same)
+        assert first[0] == 200 and first[2] == second[2]
+        assert (await blocker)[0] == 200
+    run_service(tmp_path, check)
+
+def test_full_queue_is_rejected_with_retry_after(tmp_path):
+    async def check(address):
+        asyncio.ensure_future(request(address, "POST", "/simulate", LONG_RUN))
+        await asyncio.sleep(0.5)
+        asyncio.ensure_future(request(address, "POST", "/simulate", LONG_RUN))
+        await asyncio.sleep(0.2)
+        status, head, _ = await request(address, "POST", "/simulate", LONG_RUN)
+        assert status == 503 and "Retry-After: 1" in head
+    run_service(tmp_path, check, queue_size=1)
+
+def test_running_job_id_is_rejected(tmp_path):
+    async def check(address):
+        asyncio.ensure_future(request(address, "POST", "/simulate", dict(LONG_RUN, job_id="r1")))
+        await asyncio.sleep(0.5)
+        status, _, _ = await request(address, "POST", "/simulate", dict(LONG_RUN, job_id="r1"))
+        assert status == 409
+    run_service(tmp_path, check)
+
+def test_streamed_simulation_reports_progress_then_result(tmp_path, monkeypatch):
+    monkeypatch.setattr(CSS383_ASR_Service, "PROGRESS_INTERVAL", 0.1)
+    async def check(address):
+        status, _, body = await request(address, "POST", "/simulate",\
+        dict(LONG_RUN, num_sims=10000, checkpoint_interval=500, stream=True))
+        assert status == 200
+        progress = events(body)
+        assert len(progress) > 1 and all("completed" in event for event in progress[:-1])
+        assert progress[-1]["done"] and progress[-1]["num_sims"] == 10000 and "job_id" not in progress[-1]
+        assert os.listdir(str(tmp_path)) == [] #The unnamed job's checkpoint is removed
+    run_service(tmp_path, check)
+
+def test_client_errors(tmp_path):
+    async def check(address):
+        assert (await request(address, "POST", "/simulate", dict(LONG_RUN, num_sims="many")))[0] == 400
+        assert (await request(address, "POST", "/simulate", dict(LONG_RUN, num_sims=10**6 + 1)))[0] == 400
+        assert (await request(address, "POST", "/simulate", dict(LONG_RUN, job_id="../r1")))[0] == 400
+        assert (await request(address, "POST", "/reconstruct", {"tree": "missing", "lookup": LOOKUP}))[0] == 404
+        assert (await request(address, "POST", "/simulate", content_length=10**9))[0] == 413
+    run_service(tmp_path, check)